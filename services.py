@@ -1,11 +1,190 @@
+import hashlib
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
 
 BASE_URL = "https://api.portaldatransparencia.gov.br/api-de-dados/contratos"
-HEADERS = {"chave-api-dados": st.secrets["PORTAL_TRANSPARENCIA_TOKEN"]}
+TAMANHO_PAGINA = 500  # Máximo de registros por página aceito pela API (padrão dela é bem menor)
+MAX_WORKERS = 16  # Páginas consultadas em paralelo por lote
+MAX_TENTATIVAS = 5  # Novas tentativas por página em 429 (limite de requisições) e erros 5xx
+FORMATO_DATA = "%Y-%m-%d"  # Datas de vigência vêm em ISO da API
+CACHE_DIR = Path("cache")  # Resultados persistidos em parquet, por parâmetros da consulta
+CACHE_TTL = 3600  # Validade (s) dos resultados em cache, em memória e em disco
+
+@st.cache_resource(show_spinner=False)
+def obter_sessao() -> requests.Session:
+    """
+    Sessão HTTP única por processo, para reaproveitar conexões (keep-alive) entre páginas e consultas.
+    """
+    sessao = requests.Session()
+    # Token lido só aqui (e não na importação): falta de secrets vira erro tratável pela página
+    sessao.headers.update({"chave-api-dados": st.secrets["PORTAL_TRANSPARENCIA_TOKEN"]})
+    sessao.mount("https://", HTTPAdapter(
+        pool_connections=MAX_WORKERS,
+        pool_maxsize=2 * MAX_WORKERS,
+        # Respeita o Retry-After da API; esgotadas as tentativas, a resposta de erro segue para buscar_pagina
+        max_retries=Retry(
+            total=MAX_TENTATIVAS,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,
+        ),
+    ))
+    return sessao
+
+
+def buscar_pagina(sessao: requests.Session, params: dict) -> list:
+    """
+    Consulta uma única página da API de contratos e retorna o JSON decodificado.
+    """
+    response = sessao.get(BASE_URL, params=params)
+
+    if response.status_code == 401:
+        raise Exception("Token inválido ou expirado!")
+    elif response.status_code != 200:
+        raise Exception(f"Erro na API: {response.status_code} - {response.text}")
+
+    return orjson.loads(response.content)
+
+
+def iterar_paginas(params: dict, max_paginas: int):
+    """
+    Busca a primeira página sozinha e percorre as seguintes em lotes concorrentes de MAX_WORKERS páginas.
+    Gera (pagina, dados) na ordem das páginas e para na primeira página vazia ou incompleta.
+    """
+    params = {**params, "tamanhoPagina": TAMANHO_PAGINA}
+    sessao = obter_sessao()  # Obtida aqui, fora das threads do executor
+    if max_paginas < 1:
+        return
+
+    # Página 1 isolada: a maioria das consultas cabe nela, sem disparar um lote inteiro à toa
+    dados = buscar_pagina(sessao, {**params, "pagina": 1})
+    if not dados:
+        return
+    yield 1, dados
+    tamanho_pagina = len(dados)  # Tamanho de referência de uma página cheia
+    pagina = 2
+
+    # Página 1 menor que TAMANHO_PAGINA: ou é a única, ou a API limita o tamanho abaixo do pedido.
+    # A página 2, também sozinha, desfaz a dúvida.
+    if tamanho_pagina < TAMANHO_PAGINA and max_paginas >= 2:
+        dados = buscar_pagina(sessao, {**params, "pagina": 2})
+        if not dados:
+            return
+        yield 2, dados
+        if len(dados) < tamanho_pagina:
+            return
+        pagina = 3
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while pagina <= max_paginas:
+            lote = range(pagina, min(pagina + MAX_WORKERS, max_paginas + 1))
+            resultados = executor.map(lambda p: buscar_pagina(sessao, {**params, "pagina": p}), lote)
+            for p, dados in zip(lote, resultados):
+                if not dados:
+                    return
+                yield p, dados
+                # Página incompleta é a última: não pede outro lote só para confirmar o fim
+                if len(dados) < tamanho_pagina:
+                    return
+            pagina += MAX_WORKERS
+
+
+# Tipos Arrow das colunas: datas, valores e o restante como texto
+TIPO_DATA = pd.ArrowDtype(pa.timestamp("ns"))
+TIPO_VALOR = pd.ArrowDtype(pa.float64())
+TIPO_TEXTO = pd.ArrowDtype(pa.string())
+
+# Colunas do DataFrame de contratos, na ordem de exibição
+COLUNAS = [
+    "numeroContrato", "objeto", "situacao", "valorInicial", "valorFinal",
+    "dataInicioVigencia", "dataFimVigencia", "nomeFornecedor", "cnpjFornecedor",
+    "codigoUGExecutora", "nomeUGExecutora", "codigoUGResponsavel", "nomeUGResponsavel",
+    "codigoOrgao", "nomeOrgao",
+]
+
 
-@st.cache_data(show_spinner=True)
+def extrair(registro: dict, caminho: tuple):
+    """
+    Percorre o caminho de chaves no registro; retorna None se alguma etapa faltar ou vier nula.
+    """
+    for chave in caminho:
+        registro = registro.get(chave)
+        if registro is None:
+            return None
+    return registro
+
+
+def normalizar_contratos(contratos: list, colunas: list = None) -> pd.DataFrame:
+    """
+    Converte os contratos da API (JSON) em um DataFrame com as colunas pedidas (todas, por padrão).
+    """
+    # Uma lista por coluna, preenchida na mesma passada: sem dicionário por registro
+    # e sem DataFrame intermediário para projetar as colunas pedidas
+    listas = {coluna: [] for coluna in COLUNAS}
+    # Métodos append resolvidos uma vez, fora do laço (mesma ordem de COLUNAS)
+    (
+        numero, objeto, situacao, valor_inicial, valor_final, inicio_vigencia, fim_vigencia,
+        nome_fornecedor, cnpj_fornecedor, codigo_ug_exec, nome_ug_exec, codigo_ug_resp,
+        nome_ug_resp, codigo_orgao, nome_orgao,
+    ) = [listas[coluna].append for coluna in COLUNAS]
+    for c in contratos:
+        # Subobjetos aninhados resolvidos uma vez por registro, e não a cada campo
+        fornecedor = c.get("fornecedor") or {}
+        ug_compras = c.get("unidadeGestoraCompras") or {}
+        ug = c.get("unidadeGestora") or {}
+        orgao = ug.get("orgaoVinculado") or {}
+        numero(c.get("numero") or c.get("numeroContrato"))
+        objeto(c.get("objeto"))
+        situacao(c.get("situacaoContrato"))
+        valor_inicial(c.get("valorInicialCompra"))
+        valor_final(c.get("valorFinalCompra"))
+        inicio_vigencia(c.get("dataInicioVigencia"))
+        fim_vigencia(c.get("dataFimVigencia"))
+        nome_fornecedor(fornecedor.get("nome") or fornecedor.get("razaoSocialReceita"))
+        cnpj_fornecedor(fornecedor.get("cnpjFormatado") or fornecedor.get("cnpj"))
+        codigo_ug_exec(ug_compras.get("codigo"))
+        nome_ug_exec(ug_compras.get("nome"))
+        codigo_ug_resp(ug.get("codigo"))
+        nome_ug_resp(ug.get("nome"))
+        codigo_orgao(orgao.get("codigoSIAFI"))
+        nome_orgao(orgao.get("nome"))
+    df = pd.DataFrame({coluna: listas[coluna] for coluna in colunas or COLUNAS}, copy=False)
+
+    # Converter datas e valores, e fixar os tipos Arrow de cada coluna: o esquema não depende
+    # dos dados (valores inteiros, colunas vazias) nem de o resultado vir do cache ou da API
+    for col in df.columns:
+        if col in ("dataInicioVigencia", "dataFimVigencia"):
+            df[col] = pd.to_datetime(
+                df[col], format=FORMATO_DATA, errors="coerce", cache=True
+            ).astype(TIPO_DATA)
+        elif col in ("valorInicial", "valorFinal"):
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(TIPO_VALOR)
+        else:
+            df[col] = df[col].astype("string").astype(TIPO_TEXTO)
+
+    return df
+
+
+def _caminho_cache(params: dict) -> Path:
+    """
+    Caminho do arquivo parquet em cache para um conjunto de parâmetros de consulta.
+    """
+    chave = hashlib.blake2b(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return CACHE_DIR / f"{chave}.parquet"
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=True)
 def consultar_contratos(
     codigo_orgao: str,
     cnpj: str = None,
@@ -20,60 +199,45 @@ def consultar_contratos(
     if not codigo_orgao:
         raise ValueError("O parâmetro 'codigo_orgao' é obrigatório!")
 
-    todos_dados = []
-    pagina = 1
-
-    while pagina <= max_paginas:
-        params = {"pagina": pagina, "codigoOrgao": codigo_orgao}
-        if cnpj:
-            params["cpfCnpjFornecedor"] = cnpj
-        if data_inicio:
-            params["dataInicioVigencia"] = data_inicio
-        if data_fim:
-            params["dataFimVigencia"] = data_fim
-        if valor_minimo:
-            params["valorMinimo"] = valor_minimo
-
-        response = requests.get(BASE_URL, headers=HEADERS, params=params)
-
-        if response.status_code == 401:
-            raise Exception("Token inválido ou expirado!")
-        elif response.status_code != 200:
-            raise Exception(f"Erro na API: {response.status_code} - {response.text}")
-
-        dados = response.json()
-        if not dados:
-            break
+    params = {"codigoOrgao": codigo_orgao}
+    if cnpj:
+        params["cpfCnpjFornecedor"] = cnpj
+    if data_inicio:
+        params["dataInicioVigencia"] = data_inicio
+    if data_fim:
+        params["dataFimVigencia"] = data_fim
+    if valor_minimo:
+        params["valorMinimo"] = valor_minimo
+
+    caminho = _caminho_cache({**params, "tamanhoPagina": TAMANHO_PAGINA, "max_paginas": max_paginas})
+    if caminho.exists() and time.time() - caminho.stat().st_mtime < CACHE_TTL:
+        return pd.read_parquet(caminho, dtype_backend="pyarrow")
 
+    todos_dados = []
+    for _, dados in iterar_paginas(params, max_paginas):
         todos_dados.extend(dados)
-        pagina += 1
 
     if not todos_dados:
         return pd.DataFrame()
 
-    # Transformar JSON em DataFrame
-    registros = []
-    for contrato in todos_dados:
-        registros.append({
-            "numeroContrato": contrato.get("numero") or contrato.get("numeroContrato"),
-            "objeto": contrato.get("objeto"),
-            "situacao": contrato.get("situacaoContrato"),
-            "valorInicial": contrato.get("valorInicialCompra"),
-            "valorFinal": contrato.get("valorFinalCompra"),
-            "dataInicioVigencia": contrato.get("dataInicioVigencia"),
-            "dataFimVigencia": contrato.get("dataFimVigencia"),
-            "nomeFornecedor": contrato.get("fornecedor", {}).get("nome") or contrato.get("fornecedor", {}).get("razaoSocialReceita"),
-            "cnpjFornecedor": contrato.get("fornecedor", {}).get("cnpjFormatado") or contrato.get("fornecedor", {}).get("cnpj"),
-            "codigoOrgao": contrato.get("unidadeGestora", {}).get("orgaoVinculado", {}).get("codigoSIAFI"),
-            "nomeOrgao": contrato.get("unidadeGestora", {}).get("orgaoVinculado", {}).get("nome")
-        })
-
-    df = pd.DataFrame(registros)
-
-    # Converter datas e valores
-    for col in ["dataInicioVigencia", "dataFimVigencia"]:
-        df[col] = pd.to_datetime(df[col], errors="coerce")
-    df["valorInicial"] = pd.to_numeric(df["valorInicial"], errors="coerce")
-    df["valorFinal"] = pd.to_numeric(df["valorFinal"], errors="coerce")
+    df = normalizar_contratos(todos_dados, colunas=[
+        "numeroContrato", "objeto", "situacao", "valorInicial", "valorFinal",
+        "dataInicioVigencia", "dataFimVigencia", "nomeFornecedor", "cnpjFornecedor",
+        "codigoOrgao", "nomeOrgao",
+    ])
+
+    # Persistir em disco: cada escritor usa seu próprio temporário e troca pelo arquivo final,
+    # sem expor arquivo parcial; falha ao gravar o cache não derruba a consulta
+    temporario = None
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as arquivo:
+            temporario = Path(arquivo.name)
+            df.to_parquet(arquivo, compression="zstd")
+        temporario.replace(caminho)
+    except OSError:
+        if temporario is not None:
+            temporario.unlink(missing_ok=True)
 
     return df
+
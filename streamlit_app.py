@@ -1,9 +1,23 @@
 import streamlit as st
-import requests
 import pandas as pd
-from datetime import datetime
+from datetime import date, datetime
 from io import BytesIO
-import time
+
+from services import CACHE_TTL, FORMATO_DATA, extrair, iterar_paginas, normalizar_contratos
+
+# --- Validação das datas da API ---
+def data_valida(valor: str) -> bool:
+    """
+    Indica se a data está exatamente no formato da API (o mesmo usado na conversão do DataFrame),
+    com tamanho fixo (AAAA-MM-DD) para que a comparação como string seja válida.
+    """
+    if len(valor) != 10:
+        return False
+    try:
+        datetime.strptime(valor, FORMATO_DATA)
+    except ValueError:
+        return False
+    return True
 
 # --- Função progressiva para consultar contratos ---
 def consultar_contratos_progressivo(codigo_orgao: str, ug_executora: str,
@@ -12,73 +26,52 @@ def consultar_contratos_progressivo(codigo_orgao: str, ug_executora: str,
     Consulta todas as páginas de contratos de um órgão, filtra por UG executora e contratos vigentes.
     Mostra progressivamente os resultados.
     """
-    BASE_URL = "https://api.portaldatransparencia.gov.br/api-de-dados/contratos"
-    HEADERS = {"chave-api-dados": st.secrets["PORTAL_TRANSPARENCIA_TOKEN"]}
-
     registros_filtrados = []
-    pagina = 1
-    hoje = pd.Timestamp.today()
+    # Mesmo formato das datas da API: a vigência é comparada como string, sem pandas no laço
+    hoje = date.today().strftime(FORMATO_DATA)
 
     progresso_text = st.empty()
     progresso_bar = st.progress(0)
+    pagina = 0
 
-    while pagina <= max_paginas:
-        # ✅ Enviar sempre codigoOrgao em cada requisição
-        params = {
-            "pagina": pagina,
-            "codigoOrgao": codigo_orgao
-        }
-        if valor_minimo:
-            params["valorMinimo"] = valor_minimo
-
-        response = requests.get(BASE_URL, headers=HEADERS, params=params)
-
-        if response.status_code != 200:
-            raise Exception(f"Erro na API: {response.status_code} - {response.text}")
-
-        dados = response.json()
-        if not dados:
-            break
+    # ✅ Enviar sempre codigoOrgao em cada requisição
+    params = {"codigoOrgao": codigo_orgao}
+    if valor_minimo:
+        params["valorMinimo"] = valor_minimo
 
+    # Páginas chegam em lotes paralelos, mas são processadas em ordem
+    for pagina, dados in iterar_paginas(params, max_paginas):
         # Processar e filtrar apenas os contratos da UG executora e vigentes
+        # (só guarda o registro bruto dos aprovados; nada é extraído dos descartados)
         for c in dados:
-            codigo_ug_exec = c.get("unidadeGestoraCompras", {}).get("codigo")
+            if extrair(c, ("unidadeGestoraCompras", "codigo")) != ug_executora:
+                continue
             data_fim = c.get("dataFimVigencia")
-            if codigo_ug_exec == ug_executora and data_fim and pd.to_datetime(data_fim, errors="coerce") >= hoje:
-                registros_filtrados.append({
-                    "numeroContrato": c.get("numero") or c.get("numeroContrato"),
-                    "objeto": c.get("objeto"),
-                    "situacao": c.get("situacaoContrato"),
-                    "valorInicial": c.get("valorInicialCompra"),
-                    "valorFinal": c.get("valorFinalCompra"),
-                    "dataInicioVigencia": c.get("dataInicioVigencia"),
-                    "dataFimVigencia": c.get("dataFimVigencia"),
-                    "nomeFornecedor": c.get("fornecedor", {}).get("nome") or c.get("fornecedor", {}).get("razaoSocialReceita"),
-                    "cnpjFornecedor": c.get("fornecedor", {}).get("cnpjFormatado") or c.get("fornecedor", {}).get("cnpj"),
-                    "codigoUGExecutora": codigo_ug_exec,
-                    "nomeUGExecutora": c.get("unidadeGestoraCompras", {}).get("nome"),
-                    "codigoUGResponsavel": c.get("unidadeGestora", {}).get("codigo"),
-                    "nomeUGResponsavel": c.get("unidadeGestora", {}).get("nome"),
-                    "codigoOrgao": c.get("unidadeGestora", {}).get("orgaoVinculado", {}).get("codigoSIAFI"),
-                    "nomeOrgao": c.get("unidadeGestora", {}).get("orgaoVinculado", {}).get("nome")
-                })
-
-        # Atualiza barra de progresso e mensagem
-        progresso_text.text(f"Consultando página {pagina}...")
-        progresso_bar.progress(min(pagina / max_paginas, 1.0))
-
-        pagina += 1
-        time.sleep(0.1)  # Pequena pausa para não sobrecarregar a API
-
-    df = pd.DataFrame(registros_filtrados)
-
-    # Converter datas e valores
-    for col in ["dataInicioVigencia", "dataFimVigencia"]:
-        df[col] = pd.to_datetime(df[col], errors="coerce")
-    df["valorInicial"] = pd.to_numeric(df["valorInicial"], errors="coerce")
-    df["valorFinal"] = pd.to_numeric(df["valorFinal"], errors="coerce")
-
-    return df
+            # Comparação de strings primeiro (barata); só as aprovadas passam pela validação completa.
+            # Datas malformadas ou inexistentes são descartadas, como o antigo coerce para NaT
+            if isinstance(data_fim, str) and data_fim >= hoje and data_valida(data_fim):
+                registros_filtrados.append(c)
+
+        # Atualiza barra de progresso e mensagem (a cada 5 páginas, para poupar idas ao frontend)
+        if pagina % 5 == 0:
+            progresso_text.text(f"Consultando página {pagina}...")
+            progresso_bar.progress(min(pagina / max_paginas, 1.0))
+
+    # Estado final sempre exibido, mesmo em consultas com menos de 5 páginas
+    progresso_text.text(f"Consulta concluída: {pagina} página(s).")
+    progresso_bar.progress(1.0)
+
+    return normalizar_contratos(registros_filtrados)
+
+# --- Exportação para Excel (em cache: não reserializa a cada rerun) ---
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def gerar_excel(df: pd.DataFrame) -> bytes:
+    """
+    Serializa o DataFrame em um arquivo .xlsx e retorna os bytes.
+    """
+    output = BytesIO()
+    df.to_excel(output, index=False, engine="xlsxwriter")
+    return output.getvalue()
 
 # --- Streamlit App ---
 st.set_page_config(page_title="Contratos Vigentes – Governo Federal", layout="wide")
@@ -113,9 +106,7 @@ if buscar:
                 st.dataframe(df, use_container_width=True)
 
                 # Download Excel
-                output = BytesIO()
-                df.to_excel(output, index=False, engine="openpyxl")
-                excel_bytes = output.getvalue()
+                excel_bytes = gerar_excel(df)
 
                 st.download_button(
                     "⬇️ Baixar Excel",